@@ -24,6 +24,10 @@ def create_app():
         from . import routes
         app.register_blueprint(routes.main_bp)
 
+        # Build the MongoDB indexes the API queries rely on
+        from .utils import ensure_indexes
+        ensure_indexes()
+
         logging.info("Flask application created and blueprint registered.")
         
     return app
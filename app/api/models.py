@@ -1,55 +1,102 @@
-import pandas as pd
-from sklearn.linear_model import LinearRegression
 import numpy as np
 import logging
+from numba import njit
 
-def train_and_predict(symbol, data):
+# Number of recent data points the /predict endpoint fits on
+PREDICTION_WINDOW = 1000
+
+# The time index for a full window never changes, so its centered values and
+# variance denominator are computed once here. Numba freezes these globals
+# into the compiled kernel as constants.
+_N = PREDICTION_WINDOW
+_T_MEAN = (_N - 1) / 2.0
+_T_CENTERED = np.arange(_N, dtype=np.float64) - _T_MEAN
+_DEN = float(_N * (_N * _N - 1)) / 12.0
+# Distance from the mean time index to the predicted point at t = N
+_NEXT_T_OFFSET = float(_N) - _T_MEAN
+
+@njit(cache=True, fastmath=True)
+def _fit_predict(close):
+    """
+    Compiled regression kernel.
+
+    Fits a least squares line to a contiguous float64 array of closing
+    prices over the time index 0..N-1 and evaluates it at time index N.
+
+    Returns:
+        tuple: (predicted next close, latest close)
+    """
+    n = close.shape[0]
+    # For t = 0..n-1 the mean of t is (n-1)/2 and the sum of squared
+    # deviations is n(n^2-1)/12, so only the covariance needs a pass.
+    t_mean = (n - 1) / 2.0
+    y_mean = close.mean()
+    num = 0.0
+    for i in range(n):
+        num += (close[i] - y_mean) * (i - t_mean)
+    den = n * (n * n - 1) / 12.0
+    slope = num / den
+    intercept = y_mean - slope * t_mean
+    return intercept + slope * n, close[n - 1]
+
+@njit(cache=True, fastmath=True)
+def _fit_predict_window(close):
+    """
+    Compiled regression kernel specialized for exactly PREDICTION_WINDOW points.
+
+    Same result as _fit_predict, but the time index terms are precomputed
+    constants. Since the centered time index sums to zero, the slope is a
+    single dot product with no need to center the prices, accumulated in
+    one pass alongside the mean without any temporary arrays.
+
+    Returns:
+        tuple: (predicted next close, latest close)
+    """
+    total = 0.0
+    num = 0.0
+    for i in range(_N):
+        total += close[i]
+        num += close[i] * _T_CENTERED[i]
+    y_mean = total / _N
+    slope = num / _DEN
+    return y_mean + slope * _NEXT_T_OFFSET, close[_N - 1]
+
+# Warm the JIT (or on-disk) cache at import so the first request doesn't pay for compilation.
+_fit_predict(np.zeros(10))
+_fit_predict_window(np.zeros(PREDICTION_WINDOW))
+
+def predict_from_closes(symbol, close):
     """
     A simple machine learning model function.
 
     This function performs a simple linear regression on the fly
-    to predict the next closing price based on the recent data points.
-    
+    to predict the next closing price from the recent closing prices.
+    The regression is univariate over a dense 0..N-1 time index, so it
+    is solved in closed form by a Numba-compiled kernel.
+
     Args:
         symbol (str): The stock symbol we are predicting for.
-        data (list of dicts): A list of recent data points from MongoDB.
+        close (np.ndarray): Contiguous float64 closing prices in
+            chronological order (oldest first).
 
     Returns:
         float: The predicted next closing price.
         float: The latest closing price.
     """
-    if not data or len(data) < 10:
-        logging.warning(f"[{symbol}] Not enough data to make a prediction. Need at least 10 data points, got {len(data)}.")
-        latest_close = data[-1]['close'] if data else 0.0
+    n = close.shape[0]
+    if n < 10:
+        logging.warning(f"[{symbol}] Not enough data to make a prediction. Need at least 10 data points, got {n}.")
+        latest_close = float(close[-1]) if n else 0.0
         return None, latest_close
 
-    # Convert data to a pandas DataFrame
-    df = pd.DataFrame(data)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    df = df.sort_values('timestamp').reset_index(drop=True)
-
-    # --- Feature Engineering (Simple) ---
-    # We will use a simple time index as our feature.
-    df['time_index'] = np.arange(len(df))
-    
-    # The feature 'X' must be a 2D array-like structure for scikit-learn.
-    # We select it with double brackets to create a DataFrame (which is 2D).
-    X = df[['time_index']] 
-    y = df['close'] # The target 'y' can be a 1D Series.
-
-    # --- Model Training ---
-    model = LinearRegression()
-    model.fit(X, y)
-
-    # --- Prediction ---
-    # Predict the next data point in the sequence. This also needs to be a 2D array.
-    # Create the prediction input as a DataFrame with the SAME column name as the training data.
-    next_time_index_value = len(df)
-    next_time_index_df = pd.DataFrame([[next_time_index_value]], columns=['time_index'])
-    prediction = model.predict(next_time_index_df)
-    
-    latest_close = df['close'].iloc[-1]
+    # --- Model Training & Prediction ---
+    # The math runs in the compiled kernels; this wrapper only validates and logs.
+    # A full window (the common case) takes the specialized kernel.
+    if n == PREDICTION_WINDOW:
+        prediction, latest_close = _fit_predict_window(close)
+    else:
+        prediction, latest_close = _fit_predict(close)
     
-    logging.info(f"[{symbol}] Prediction successful. Latest Close: {latest_close:.2f}, Predicted Next Close: {prediction[0]:.2f}")
+    logging.info(f"[{symbol}] Prediction successful. Latest Close: {latest_close:.2f}, Predicted Next Close: {prediction:.2f}")
 
-    return prediction[0], latest_close
\ No newline at end of file
+    return prediction, latest_close
@@ -1,19 +1,150 @@
 #API endpoints
-from flask import Blueprint, jsonify, render_template, current_app
-from .utils import get_mongo_db, get_redis_client
-from .models import train_and_predict
-import json
+from flask import Blueprint, jsonify, render_template, current_app, request
+from .utils import get_mongo_db, get_redis_client, SYMBOLS, TICKS_COLLECTION
+from .models import predict_from_closes, PREDICTION_WINDOW
+from cachetools import TTLCache
+from concurrent.futures import Future
+import hashlib
 import logging
+import msgpack
+import numpy as np
+import orjson
+import pymongo
+import redis
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 
 # Create a Blueprint
 main_bp = Blueprint('main_bp', __name__)
 
 # --- Configuration ---
-# List of stock symbols our app tracks, should match the ingestion service
-SYMBOLS = ['AAPL', 'GOOGL', 'MSFT', 'TSLA', 'AMZN']
 API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
+# Ingestion runs daily, so a prediction keyed on the latest data point can live this long
+PREDICTION_CACHE_SECONDS = 60 * 60 * 24
+# How long browsers may reuse a /predict or /chart_data response before revalidating
+CLIENT_MAX_AGE_SECONDS = 5
+# News sentiment is cached for 1 hour, both in Redis and in-process
+SENTIMENT_CACHE_SECONDS = 60 * 60
+# Only these fields are read by the endpoints, so don't ship whole documents
+POINT_PROJECTION = {'close': 1, 'timestamp': 1, '_id': 0}
+# (connect, read) timeouts for the sentiment proxy. A request thread (and every
+# /sentiment request coalesced onto it) waits on this call, so keep it short.
+HTTP_TIMEOUT = (3.05, 5)
+
+# --- HTTP Session ---
+# Shared by all request threads so /sentiment reuses its TLS connection to
+# Alpha Vantage. A single quick retry smooths over a blip; anything longer is
+# better surfaced as an error than held in a gunicorn thread.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(total=1, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+# --- In-process sentiment cache ---
+# L1 in front of Redis, local to each worker process. TTLCache isn't
+# thread-safe, so it is only touched under _sentiment_lock, which also guards
+# the map of in-flight loads used to coalesce concurrent misses.
+_sentiment_cache = TTLCache(maxsize=128, ttl=SENTIMENT_CACHE_SECONDS)
+_sentiment_inflight = {}
+_sentiment_lock = threading.Lock()
+
+def json_response(payload, status=200):
+    """
+    Serializes `payload` with orjson, which is much faster than the stdlib
+    encoder behind jsonify and handles datetimes and NumPy arrays natively.
+    Naive datetimes from MongoDB are UTC.
+    """
+    return current_app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json',
+    )
+
+def latest_version(collection, symbol):
+    """
+    Returns the (timestamp, updated_at) pair of the newest data point for
+    `symbol`, or None if there is none yet. Served straight from the ticks
+    index. The ingester rewrites the newest row on every run (and every row
+    on a forced reload), so updated_at changes whenever the data does even
+    if no newer day has been added.
+    """
+    latest = collection.find_one(
+        {'symbol': symbol}, {'timestamp': 1, 'updated_at': 1, '_id': 0}, sort=[('timestamp', -1)]
+    )
+    return (latest['timestamp'], latest.get('updated_at')) if latest else None
+
+def latest_cached_prediction(redis_client, symbol):
+    """
+    Returns the serialized prediction most recently computed for `symbol`,
+    or None if Redis doesn't have one (or can't be reached either).
+    """
+    try:
+        return redis_client.get(f'prediction:{symbol}:latest')
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"[{symbol}] Redis lookup of last prediction failed: {e}")
+        return None
+
+def data_etag(version):
+    """
+    ETag for a response derived from stored data, given the newest data
+    point's version (or a list of them, one per symbol). It only changes
+    when the stored data changes.
+    """
+    return hashlib.md5(str(version).encode()).hexdigest()
+
+def not_modified(etag):
+    """
+    Returns an empty 304 response if the client already holds `etag`, else None.
+    """
+    if request.if_none_match.contains(etag):
+        return with_etag(current_app.response_class(status=304), etag)
+    return None
+
+def with_etag(response, etag):
+    """
+    Tags `response` with `etag` and a short client cache lifetime.
+    """
+    response.set_etag(etag)
+    response.cache_control.max_age = CLIENT_MAX_AGE_SECONDS
+    return response
+
+def load_recent_closes(collection, symbol, limit):
+    """
+    Streams the newest `limit` closing prices for `symbol` straight from the
+    cursor into a preallocated float64 buffer, filling it back to front so
+    the result is chronological and contiguous without building a list of
+    documents first. Returns a view holding only the points that exist.
+    """
+    closes = np.empty(limit, dtype=np.float64)
+    i = limit
+    cursor = collection.find(
+        {'symbol': symbol}, {'close': 1, '_id': 0},
+        sort=[('timestamp', -1)], limit=limit,
+    )
+    for doc in cursor:
+        i -= 1
+        closes[i] = doc['close']
+    return closes[i:]
+
+def recent_points_pipeline(symbol, limit, projection=POINT_PROJECTION):
+    """
+    Aggregation pipeline returning the most recent `limit` data points for
+    `symbol` in chronological order. The newest-N selection walks the ticks
+    index and the final re-sort of those N points happens server-side, so
+    Python never has to reverse the result.
+    """
+    return [
+        {'$match': {'symbol': symbol}},
+        {'$sort': {'timestamp': -1}},
+        {'$limit': limit},
+        {'$project': projection},
+        {'$sort': {'timestamp': 1}},
+    ]
 
 @main_bp.route('/')
 def index():
@@ -26,48 +157,72 @@ def index():
 def predict(symbol):
     """
     API endpoint to get a prediction for a given stock symbol.
-    It first checks for a cached result in Redis. If not found, it
-    fetches data from MongoDB, runs the prediction, and caches the result.
+    The cache key is fingerprinted with the version (timestamp and last
+    update) of the newest data point, so a cached prediction stays valid
+    until the next ingestion rewrites the data.
+    If no cached result is found, it fetches data from MongoDB, runs the
+    prediction, and caches the result.
     """
     if symbol.upper() not in SYMBOLS:
-        return jsonify({"error": "Symbol not tracked"}), 404
+        return json_response({"error": "Symbol not tracked"}, 404)
 
     try:
         redis_client = get_redis_client()
         db = get_mongo_db()
+        collection = db[TICKS_COLLECTION]
 
-        if redis_client:
-            # 1. Check cache first
-            cached_result = redis_client.get(f'prediction:{symbol}')
+        # 1. Look up the newest data point's version (served straight from
+        # the index). If the client already has the response for it, we're done.
+        try:
+            version = latest_version(collection, symbol.upper())
+        except pymongo.errors.PyMongoError as e:
+            # MongoDB is unreachable: fail open with the last prediction we
+            # computed, if Redis still has it.
+            logging.warning(f"[{symbol}] MongoDB lookup failed, trying last cached prediction: {e}")
+            fallback = latest_cached_prediction(redis_client, symbol.upper())
+            if fallback is None:
+                raise
+            return current_app.response_class(fallback, mimetype='application/json')
+        if version is None:
+            return json_response({"error": "No data available for this symbol yet"}, 404)
+        etag = data_etag(version)
+        cached_response = not_modified(etag)
+        if cached_response:
+            return cached_response
+        cache_key = f"prediction:{symbol.upper()}:{etag}"
+
+        # 2. Check cache for this data state. Redis trouble shouldn't take
+        # the endpoint down, so fall through to computing on errors.
+        try:
+            cached_result = redis_client.get(cache_key)
             if cached_result:
                 logging.info(f"[{symbol}] Found cached prediction.")
-                return jsonify(json.loads(cached_result))
+                # The cached value is already the serialized response body.
+                return with_etag(current_app.response_class(cached_result, mimetype='application/json'), etag)
+        except redis.exceptions.RedisError as e:
+            logging.warning(f"[{symbol}] Redis lookup failed, computing prediction: {e}")
 
-        # 2. If not in cache, fetch from DB and predict
+        # 3. If not in cache, fetch from DB and predict
         logging.info(f"[{symbol}] No cache. Fetching data from MongoDB.")
-        collection = db[symbol.upper()]
-        
-        # Fetch the most recent 100 data points, sorted by time descending
-        recent_data = list(collection.find().sort('timestamp', -1).limit(1000))
         
-        if not recent_data:
-            return jsonify({"error": "No data available for this symbol yet"}), 404
+        # Fetch the closes of the most recent PREDICTION_WINDOW data points in chronological order
+        recent_closes = load_recent_closes(collection, symbol.upper(), PREDICTION_WINDOW)
         
-        # The data is descending, so we reverse it for chronological order
-        recent_data.reverse()
+        if recent_closes.size == 0:
+            return json_response({"error": "No data available for this symbol yet"}, 404)
 
-        # 3. Get prediction from our model
-        prediction, latest_close = train_and_predict(symbol.upper(), recent_data)
+        # 4. Get prediction from our model
+        prediction, latest_close = predict_from_closes(symbol.upper(), recent_closes)
 
         if prediction is None:
-             return jsonify({
+             return with_etag(json_response({
                 "symbol": symbol.upper(),
                 "latest_close": latest_close,
                 "prediction": "Not enough data",
                 "recommendation": "Hold"
-            })
+            }), etag)
 
-        # 4. Generate a simple recommendation
+        # 5. Generate a simple recommendation
         recommendation = "Buy" if prediction > latest_close else "Sell"
         
         result = {
@@ -77,72 +232,210 @@ def predict(symbol):
             "recommendation": recommendation
         }
 
-        # 5. Cache the result in Redis for 60 seconds
-        if redis_client:
-            redis_client.set(f'prediction:{symbol}', json.dumps(result), ex=60)
+        # 6. Cache the result until the data changes (a day at most), and keep
+        # a "latest" copy to fall back on while MongoDB is unreachable. Both
+        # writes go out in a single round trip.
+        try:
+            payload = orjson.dumps(result)
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.set(cache_key, payload, ex=PREDICTION_CACHE_SECONDS)
+            pipe.set(f'prediction:{symbol.upper()}:latest', payload, ex=PREDICTION_CACHE_SECONDS)
+            pipe.execute()
             logging.info(f"[{symbol}] Cached new prediction.")
+        except redis.exceptions.RedisError as e:
+            logging.warning(f"[{symbol}] Could not cache prediction: {e}")
 
-        return jsonify(result)
+        return with_etag(json_response(result), etag)
 
     except Exception as e:
         logging.error(f"An error occurred in prediction endpoint for {symbol}: {e}")
-        return jsonify({"error": "An internal server error occurred"}), 500
+        return json_response({"error": "An internal server error occurred"}, 500)
 
 @main_bp.route('/chart_data/<string:symbol>')
 def chart_data(symbol):
     """
     API endpoint to fetch the last 100 data points for chart visualization.
+    Responses carry an ETag tied to the newest data point, so polling clients
+    get an empty 304 until the data changes.
     """
     if symbol.upper() not in SYMBOLS:
-        return jsonify({"error": "Symbol not tracked"}), 404
+        return json_response({"error": "Symbol not tracked"}, 404)
 
     try:
         db = get_mongo_db()
-        collection = db[symbol.upper()]
+        collection = db[TICKS_COLLECTION]
+
+        etag = data_etag(latest_version(collection, symbol.upper()))
+        cached_response = not_modified(etag)
+        if cached_response:
+            return cached_response
         
         # Fetch the most recent 100 data points for the initial chart view
-        chart_points = list(collection.find().sort('timestamp', -1).limit(100))
-        chart_points.reverse() # Reverse to have them in chronological order
+        chart_points = list(
+            collection.aggregate(recent_points_pipeline(symbol.upper(), 100), allowDiskUse=False)
+        )
 
         # Format the data for Chart.js
-        labels = [point['timestamp'].strftime('%H:%M:%S') for point in chart_points]
+        # orjson encodes the datetimes natively, no per-point strftime needed
+        labels = [point['timestamp'] for point in chart_points]
         data = [point['close'] for point in chart_points]
 
-        return jsonify({"labels": labels, "data": data})
+        return with_etag(json_response({"labels": labels, "data": data}), etag)
 
     except Exception as e:
         logging.error(f"An error occurred in chart_data endpoint for {symbol}: {e}")
-        return jsonify({"error": "An internal server error occurred"}), 500
+        return json_response({"error": "An internal server error occurred"}, 500)
 
-@main_bp.route('/sentiment/<string:symbol>')
-def sentiment(symbol):
+@main_bp.route('/dashboard')
+def dashboard():
     """
-    API endpoint to fetch news and sentiment data for a stock.
+    API endpoint returning the chart data and latest close for every tracked
+    symbol in one response, so the page doesn't need a request per symbol.
+    Each MongoDB query is a single aggregation over the ticks collection, and
+    the payload is cached in Redis until any symbol receives new data.
     """
     try:
         redis_client = get_redis_client()
-        
-        # Check cache first
-        cache_key = f"sentiment:{symbol}"
-        if redis_client and redis_client.exists(cache_key):
+        db = get_mongo_db()
+        collection = db[TICKS_COLLECTION]
+
+        # 1. Fingerprint the data state with every symbol's newest data point
+        # version. Sorting in index order lets $group/$first jump straight to
+        # each symbol's newest entry.
+        latest_points = collection.aggregate([
+            {'$match': {'symbol': {'$in': SYMBOLS}}},
+            {'$sort': {'symbol': 1, 'timestamp': -1}},
+            {'$group': {
+                '_id': '$symbol',
+                'timestamp': {'$first': '$timestamp'},
+                'updated_at': {'$first': '$updated_at'},
+            }},
+        ])
+        latest = {point['_id']: (point['timestamp'], point.get('updated_at')) for point in latest_points}
+        etag = data_etag([latest.get(symbol) for symbol in SYMBOLS])
+        cached_response = not_modified(etag)
+        if cached_response:
+            return cached_response
+        cache_key = f"dashboard:{etag}"
+
+        # 2. Check cache for this data state
+        try:
+            cached_result = redis_client.get(cache_key)
+            if cached_result:
+                logging.info("Found cached dashboard.")
+                return with_etag(current_app.response_class(cached_result, mimetype='application/json'), etag)
+        except redis.exceptions.RedisError as e:
+            logging.warning(f"Redis lookup failed, building dashboard: {e}")
+
+        # 3. Fetch the last 100 points of every symbol in one round trip. Each
+        # symbol's branch is its own bounded index scan on the ticks index.
+        projection = {**POINT_PROJECTION, 'symbol': 1}
+        pipeline = recent_points_pipeline(SYMBOLS[0], 100, projection)
+        for other in SYMBOLS[1:]:
+            pipeline.append({'$unionWith': {
+                'coll': TICKS_COLLECTION,
+                'pipeline': recent_points_pipeline(other, 100, projection),
+            }})
+        result = {symbol: {"labels": [], "data": [], "latest_close": None} for symbol in SYMBOLS}
+        for point in collection.aggregate(pipeline):
+            entry = result[point['symbol']]
+            entry["labels"].append(point['timestamp'])
+            entry["data"].append(point['close'])
+        for entry in result.values():
+            if entry["data"]:
+                # Rounded like /predict, since both fill the same element on the page
+                entry["latest_close"] = round(entry["data"][-1], 2)
+
+        # 4. Cache the payload until the data changes (a day at most)
+        payload = orjson.dumps(result, option=orjson.OPT_NAIVE_UTC)
+        try:
+            redis_client.set(cache_key, payload, ex=PREDICTION_CACHE_SECONDS)
+            logging.info("Cached new dashboard.")
+        except redis.exceptions.RedisError as e:
+            logging.warning(f"Could not cache dashboard: {e}")
+
+        return with_etag(current_app.response_class(payload, mimetype='application/json'), etag)
+
+    except Exception as e:
+        logging.error(f"An error occurred in dashboard endpoint: {e}")
+        return json_response({"error": "An internal server error occurred"}, 500)
+
+def load_sentiment(symbol):
+    """
+    Fetches news and sentiment data for a stock, checking the shared
+    Redis cache before calling Alpha Vantage.
+    """
+    redis_client = get_redis_client()
+
+    # Check cache first. Entries are msgpack-encoded; the v2 namespace keeps
+    # us from reading JSON blobs written by older versions.
+    cache_key = f"sentiment:v2:{symbol}"
+    try:
+        cached_result = redis_client.get(cache_key)
+        if cached_result:
             logging.info(f"[{symbol}] Found cached sentiment.")
-            return jsonify(json.loads(redis_client.get(cache_key)))
+            return msgpack.unpackb(cached_result, raw=False)
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"[{symbol}] Redis lookup failed, fetching sentiment: {e}")
 
-        # Fetch from Alpha Vantage
-        # Note: The API requires the 'tickers' parameter, not 'symbol'
-        url = (
-            f'https://www.alphavantage.co/query?function=NEWS_SENTIMENT'
-            f'&tickers={symbol}&apikey={API_KEY}'
-        )
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        
-        # Cache the result for 1 hour (3600 seconds)
-        if redis_client:
-            redis_client.set(cache_key, json.dumps(data), ex=3600)
-            
-        return jsonify(data)
+    # Fetch from Alpha Vantage
+    # Note: The API requires the 'tickers' parameter, not 'symbol'
+    url = (
+        f'https://www.alphavantage.co/query?function=NEWS_SENTIMENT'
+        f'&tickers={symbol}&apikey={API_KEY}'
+    )
+    response = SESSION.get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+
+    # Cache the result for 1 hour (3600 seconds)
+    try:
+        redis_client.set(cache_key, msgpack.packb(data, use_bin_type=True), ex=SENTIMENT_CACHE_SECONDS)
+    except redis.exceptions.RedisError as e:
+        logging.warning(f"[{symbol}] Could not cache sentiment: {e}")
+
+    return data
+
+def get_sentiment(symbol):
+    """
+    Returns sentiment data from the in-process cache, loading it on a miss.
+    Concurrent misses for the same symbol share a single load, so a burst of
+    requests (or a Redis outage) results in one upstream call, not many.
+    """
+    with _sentiment_lock:
+        data = _sentiment_cache.get(symbol)
+        if data is not None:
+            return data
+        future = _sentiment_inflight.get(symbol)
+        is_loader = future is None
+        if is_loader:
+            future = Future()
+            _sentiment_inflight[symbol] = future
+
+    if not is_loader:
+        # Another thread is already loading this symbol; wait for its result.
+        return future.result()
+
+    try:
+        data = load_sentiment(symbol)
+        with _sentiment_lock:
+            _sentiment_cache[symbol] = data
+        future.set_result(data)
+        return data
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _sentiment_lock:
+            _sentiment_inflight.pop(symbol, None)
+
+@main_bp.route('/sentiment/<string:symbol>')
+def sentiment(symbol):
+    """
+    API endpoint to fetch news and sentiment data for a stock.
+    """
+    try:
+        return jsonify(get_sentiment(symbol))
 
     except Exception as e:
         logging.error(f"An error occurred in sentiment endpoint for {symbol}: {e}")
@@ -2,11 +2,16 @@
 
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pymongo
 import time
 import threading
+import itertools
 import logging
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # --- Configuration ---
@@ -14,8 +19,32 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/realtimedb')
 API_KEY = os.getenv('ALPHA_VANTAGE_API_KEY')
 SYMBOLS = ['AAPL', 'GOOGL', 'MSFT', 'TSLA', 'AMZN']
+# All symbols' data points live in one collection, indexed by (symbol, timestamp)
+TICKS_COLLECTION = 'ticks'
+TICKS_INDEX = [('symbol', pymongo.ASCENDING), ('timestamp', pymongo.DESCENDING)]
 # We'll run ingestion once a day, so FETCH_INTERVAL is less critical but good for safety
 FETCH_INTERVAL_SECONDS = 60 * 60 * 24 # 24 hours
+# Alpha Vantage free tier allows 5 calls per minute
+API_CALLS_PER_WINDOW = 5
+API_WINDOW_SECONDS = 60
+MAX_WORKERS = len(SYMBOLS)
+# (connect, read) timeouts for the daily fetch. Nobody is waiting on this batch
+# job, so allow slow responses, but never let a stalled socket block a cycle.
+HTTP_TIMEOUT = (3.05, 10)
+
+# --- HTTP Session ---
+# The ingestion workers share this session so all symbols reuse one TLS
+# connection. Losing a symbol means a day-old chart, so transient server
+# errors are retried patiently with backoff. HTTP 429 is deliberately not
+# retried here: these retries bypass the RateLimiter and RequestCounter, and
+# a sub-minute retry can only spend more of the per-minute quota. Pacing is
+# the RateLimiter's job.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]),
+))
 
 # --- Database Connection ---
 def get_db_connection():
@@ -25,22 +54,57 @@ def get_db_connection():
             client = pymongo.MongoClient(MONGO_URI)
             client.admin.command('ismaster')
             logging.info("Successfully connected to MongoDB.")
-            return client['realtimedb']
+            db = client['realtimedb']
+            db[TICKS_COLLECTION].create_index(TICKS_INDEX)
+            return db
         except pymongo.errors.ConnectionFailure as e:
             logging.error(f"Could not connect to MongoDB: {e}. Retrying in 5 seconds...")
             time.sleep(5)
 
 # --- NEW: A simple class to act as a mutable counter ---
 class RequestCounter:
+    # Shared by the ingestion worker threads. `self.count += 1` is a
+    # read-modify-write that can lose updates, whereas next() on an
+    # itertools.count is a single C call and atomic under the GIL, so every
+    # increment gets its own number. Reading never touches the counter.
     def __init__(self):
+        self._c = itertools.count(1)
         self.count = 0
     def increment(self):
-        self.count += 1
+        self.count = next(self._c)
     def get(self):
         return self.count
 
+# --- Rate limiting for concurrent fetches ---
+class RateLimiter:
+    """
+    Blocks callers so that no more than `max_calls` happen in any
+    `period` second window, no matter how many threads share it.
+    """
+    def __init__(self, max_calls=API_CALLS_PER_WINDOW, period=API_WINDOW_SECONDS):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls = deque()
+        self._lock = threading.Lock()
+        # Signalled once the API reports the quota is exhausted, so the
+        # remaining workers stop instead of burning more requests.
+        self.exhausted = threading.Event()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # Drop calls that have left the window
+                while self._calls and now - self._calls[0] >= self.period:
+                    self._calls.popleft()
+                if len(self._calls) < self.max_calls:
+                    self._calls.append(now)
+                    return
+                wait = self.period - (now - self._calls[0])
+            time.sleep(wait)
+
 # --- NEW: Central API Fetching Function ---
-def fetch_alpha_vantage_data(url, symbol, counter):
+def fetch_alpha_vantage_data(url, symbol, counter, session):
     """
     Fetches data from the given URL and handles common API errors gracefully.
     Returns the JSON data if successful, otherwise returns None.
@@ -48,7 +112,7 @@ def fetch_alpha_vantage_data(url, symbol, counter):
     try:
         # Increment the counter for every attempt
         counter.increment()
-        response = requests.get(url)
+        response = session.get(url, timeout=HTTP_TIMEOUT)
         response.raise_for_status()
         data = response.json()
 
@@ -75,41 +139,88 @@ def fetch_alpha_vantage_data(url, symbol, counter):
         return None
 
 # --- Data Processing ---
-def process_and_save_daily_data(symbol, time_series_data, db):
+def process_and_save_daily_data(symbol, time_series_data, db, force_reload=False):
     """
     Processes daily time series data and upserts it into the database.
+    Past OHLCV rows are immutable, so by default only dates that are not
+    stored yet are written. The newest date is the exception: during market
+    hours it holds the current day's live prices, so it is always overwritten.
+    Pass force_reload=True to overwrite every row (e.g. after an upstream
+    correction). The first load of a symbol is a plain unordered insert,
+    skipping the per-row existence check of an upsert.
+
+    Every written row is stamped with `updated_at`; the API fingerprints the
+    data by the newest row's timestamp and updated_at, so rewrites of that row
+    invalidate cached predictions and ETags.
     """
     # ... (This function is similar to before, but tailored for daily data) ...
-    collection = db[symbol.upper()]
-    operations = []
+    collection = db[TICKS_COLLECTION]
+    records = []
+    updated_at = datetime.utcnow()
+    # ISO dates sort chronologically as strings
+    newest_date = max(time_series_data, default=None)
 
     for date_str, values in time_series_data.items():
         record = {
             '_id': f"{symbol}-{date_str}",
             'symbol': symbol,
-            'timestamp': datetime.strptime(date_str, "%Y-%m-%d"),
+            # fromisoformat parses YYYY-MM-DD far faster than strptime
+            'timestamp': datetime.fromisoformat(date_str),
             'open': float(values['1. open']),
             'high': float(values['2. high']),
             'low': float(values['3. low']),
             'close': float(values['4. close']),
             # 'adjusted_close': float(values['5. adjusted close']),
-            'volume': int(values['5. volume'])
+            'volume': int(values['5. volume']),
+            'updated_at': updated_at
         }
-        operations.append(pymongo.UpdateOne({'_id': record['_id']}, {'$set': record}, upsert=True))
+        records.append(record)
 
-    if not operations:
+    if not records:
         logging.info(f"[{symbol}] No new records to insert.")
         return
 
-    result = collection.bulk_write(operations)
-    logging.info(f"[{symbol}] Daily data processed. Upserted: {result.upserted_count}, Matched: {result.matched_count}")
+    # Nothing stored for this symbol yet (one lookup on the ticks index), so
+    # every row is new and can be inserted directly.
+    if collection.find_one({'symbol': symbol}, {'_id': 1}) is None:
+        try:
+            result = collection.insert_many(records, ordered=False)
+            inserted = len(result.inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            # Another ingester may have inserted some of the same rows in the
+            # meantime. _ids are deterministic, so duplicates are the same data.
+            if any(err['code'] != 11000 for err in e.details['writeErrors']):
+                raise
+            inserted = e.details['nInserted']
+        logging.info(f"[{symbol}] Initial daily data loaded. Inserted: {inserted}")
+        return
+
+    operations = []
+    for date_str, record in zip(time_series_data, records):
+        update_operator = '$set' if force_reload or date_str == newest_date else '$setOnInsert'
+        operations.append(pymongo.UpdateOne({'_id': record['_id']}, {update_operator: record}, upsert=True))
+
+    # The rows are independent, so let the server apply them in any order.
+    result = collection.bulk_write(operations, ordered=False)
+    if force_reload:
+        logging.info(f"[{symbol}] Daily data reloaded. Upserted: {result.upserted_count}, Modified: {result.modified_count}")
+    else:
+        logging.info(f"[{symbol}] Daily data processed. Upserted: {result.upserted_count}, Refreshed latest: {result.modified_count}")
 
 
 # --- Refactored Ingestion Logic ---
-def run_daily_ingestion(symbol, db, counter):
+def run_daily_ingestion(symbol, db, counter, limiter, session, force_reload=False):
     """
     Runs the full daily ingestion logic for a single symbol.
+    Safe to call from several threads at once; `limiter` paces the API calls.
     """
+    # Wait for a free slot in the API quota, then bail out if another
+    # worker already hit the rate limit while we were waiting.
+    limiter.acquire()
+    if limiter.exhausted.is_set():
+        logging.info(f"[{symbol}] Skipping, API rate limit already reached this cycle.")
+        return False
+
     logging.info(f"[{symbol}] Starting daily ingestion...")
     # Using TIME_SERIES_DAILY_ADJUSTED for daily data
     # 'outputsize=full' gets up to 20 years of data, but we'll only process recent ones
@@ -120,21 +231,23 @@ def run_daily_ingestion(symbol, db, counter):
         f'&symbol={symbol}&outputsize=compact&apikey={API_KEY}'
     )
     
-    data = fetch_alpha_vantage_data(url, symbol, counter)
+    data = fetch_alpha_vantage_data(url, symbol, counter, session)
     
     # If fetch failed or hit a limit, data will be None
     if data and "Time Series (Daily)" in data:
-        process_and_save_daily_data(symbol, data["Time Series (Daily)"], db)
+        process_and_save_daily_data(symbol, data["Time Series (Daily)"], db, force_reload)
     else:
         logging.warning(f"[{symbol}] Could not retrieve or process daily data.")
         # If the fetch function returned None, it might be a rate limit error.
-        # We can return False to signal the main loop to stop.
+        # Signal the other workers to stop making requests.
+        if data is None:
+            limiter.exhausted.set()
         return data is not None
     return True
 
 
 # --- Main Application Logic ---
-def main():
+def main(force_reload=False):
     """
     Main function to orchestrate the data ingestion process.
     This script now runs a daily ingestion cycle.
@@ -145,15 +258,14 @@ def main():
 
     db = get_db_connection()
     counter = RequestCounter() # Initialize the counter
+    # Be respectful of the API limit (5 calls per minute) across all workers
+    limiter = RateLimiter()
     
     logging.info("--- Starting Daily Ingestion Cycle ---")
-    for symbol in SYMBOLS:
-        success = run_daily_ingestion(symbol, db, counter)
-        # Be respectful of the API limit (5 calls per minute)
-        if not success:
-            # If run_daily_ingestion returns False, it means a rate limit was hit.
-            break # Exit the loop to stop making more requests.
-        time.sleep(15) 
+    # Fetches are I/O-bound, so symbols are ingested concurrently over the
+    # shared HTTP session that reuses its TCP/TLS connections.
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(lambda symbol: run_daily_ingestion(symbol, db, counter, limiter, SESSION, force_reload), SYMBOLS))
     logging.info("--- Daily Ingestion Cycle Complete ---")
     
     # In a real-world scheduler (like cron), the script would exit here.
@@ -164,5 +276,11 @@ def main():
 
 
 if __name__ == "__main__":
-    # We no longer need argparse, as the container will just run this daily cycle.
-    main()
\ No newline at end of file
+    # The container just runs the daily cycle; the flag is for manual corrections.
+    parser = argparse.ArgumentParser(description="Daily Alpha Vantage ingestion.")
+    parser.add_argument(
+        '--force-reload', action='store_true',
+        help="Overwrite stored rows with freshly fetched values instead of only inserting new dates."
+    )
+    args = parser.parse_args()
+    main(force_reload=args.force_reload)
\ No newline at end of file
@@ -0,0 +1,49 @@
+# One-off migration from per-symbol collections to the shared 'ticks' collection.
+# Run from the ingestion container: python -u data_ingestion/migrate_to_ticks.py
+
+import argparse
+import logging
+import pymongo
+from ingest import get_db_connection, SYMBOLS, TICKS_COLLECTION
+
+BATCH_SIZE = 1000
+
+def migrate_symbol(db, symbol):
+    """
+    Copies every document of the `symbol` collection into the ticks
+    collection, keeping its _id and making sure the symbol field is set.
+    Documents already present in ticks are left untouched, so the
+    migration can be re-run safely.
+    """
+    source = db[symbol]
+    target = db[TICKS_COLLECTION]
+    operations = []
+    copied = 0
+
+    for doc in source.find():
+        doc['symbol'] = symbol
+        operations.append(pymongo.UpdateOne({'_id': doc['_id']}, {'$setOnInsert': doc}, upsert=True))
+        if len(operations) == BATCH_SIZE:
+            copied += target.bulk_write(operations, ordered=False).upserted_count
+            operations = []
+    if operations:
+        copied += target.bulk_write(operations, ordered=False).upserted_count
+
+    logging.info(f"[{symbol}] Migrated {copied} new documents into '{TICKS_COLLECTION}'.")
+
+def main(drop_source=False):
+    db = get_db_connection() # Also builds the ticks index
+    for symbol in SYMBOLS:
+        migrate_symbol(db, symbol)
+        if drop_source:
+            db[symbol].drop()
+            logging.info(f"[{symbol}] Dropped the old per-symbol collection.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Merge per-symbol collections into '{TICKS_COLLECTION}'.")
+    parser.add_argument(
+        '--drop-source', action='store_true',
+        help="Drop each per-symbol collection once its documents have been copied."
+    )
+    args = parser.parse_args()
+    main(drop_source=args.drop_source)
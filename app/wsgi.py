@@ -0,0 +1,4 @@
+# WSGI entrypoint for gunicorn
+from api.app import create_app
+
+app = create_app()